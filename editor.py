@@ -1,33 +1,121 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, abort
-from glob import glob
+from flask import Flask, Response, make_response, render_template, request, redirect, url_for, flash, send_file, abort
+from collections import defaultdict
+from pathlib import Path
+from urllib.parse import quote
+import csv
+import mimetypes
 import os
-import pandas as pd
+import shutil
+import stat
+from tempfile import SpooledTemporaryFile
+import threading
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'
+# Set to True behind Apache with mod_xsendfile to let it send audio files
+app.config['USE_X_SENDFILE'] = False
 
 # Directory containing subfolders with schedule.csv files
 BASE_DIR = '/mnt/data/sstv'
+BASE_PATH = Path(BASE_DIR).resolve()
+
+# Columns of schedule.csv, in file order
+SCHEDULE_COLUMNS = (
+    'Start Date', 'End Date', 'Start Time', 'Duration (minutes)',
+    'Frequency (MHz)', 'Mode', 'Power (W)', 'Pause (sec)'
+)
+SCHEDULE_HEADER = (';'.join(SCHEDULE_COLUMNS) + '\n').encode()
+
+# Audio file types accepted for upload and transmission
+AUDIO_EXTENSIONS = frozenset({'.wav', '.mp3'})
+
+# Chunk size used when copying uploaded audio files to disk
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Internal nginx location aliased to BASE_DIR (see nginx.sample.conf). When
+# set, audio files are served by nginx via X-Accel-Redirect instead of Flask.
+ACCEL_REDIRECT_PREFIX = None
+
+# Directory listings, rebuilt only when the directory mtime changes
+_folders_cache = None
+_audio_files_cache = {}
+
+# Parsed schedules, reused while the file on disk is unchanged
+_schedule_cache = {}
+
+# Per-file locks serializing schedule.csv writes within a worker process
+_schedule_locks = defaultdict(threading.Lock)
+_schedule_locks_guard = threading.Lock()
+
+def _schedule_lock(csv_path):
+    with _schedule_locks_guard:
+        return _schedule_locks[csv_path]
+
+# Securely join paths, aborting if the result is outside the base directory
+def safe_path(*parts):
+    path = BASE_PATH.joinpath(*parts).resolve()
+    if not path.is_relative_to(BASE_PATH):
+        abort(403)  # Forbidden access
+    return path
+
+# Send a rendered page with an ETag, answering 304 if the browser has it already
+def _conditional_page(html):
+    response = make_response(html)
+    response.cache_control.no_cache = True
+    response.add_etag()
+    return response.make_conditional(request)
+
+# Copy an uploaded file to disk. Uploads Werkzeug already spooled to a
+# temporary file are copied by the kernel with sendfile(2), uploads still held
+# in memory in large chunks.
+def _save_upload(file, path):
+    stream = file.stream
+    with open(path, 'wb') as out:
+        # fileno() would roll an in-memory spool over to disk, check first
+        if isinstance(stream, SpooledTemporaryFile) and not stream._rolled:
+            shutil.copyfileobj(stream, out, UPLOAD_CHUNK_SIZE)
+            return
+
+        try:
+            stream.flush()
+            in_fd = stream.fileno()
+        except (AttributeError, OSError):
+            shutil.copyfileobj(stream, out, UPLOAD_CHUNK_SIZE)
+            return
+
+        offset, size = 0, os.fstat(in_fd).st_size
+        while offset < size:
+            sent = os.sendfile(out.fileno(), in_fd, offset, size - offset)
+            if not sent:
+                break
+            offset += sent
 
 @app.route('/')
 def index():
-    folders = [f for f in os.listdir(BASE_DIR) if os.path.isdir(os.path.join(BASE_DIR, f))]
-    return render_template('index.html', folders=folders)
+    global _folders_cache
+
+    mtime = os.stat(BASE_DIR).st_mtime_ns
+    cached = _folders_cache
+    if cached and cached[0] == mtime:
+        folders = cached[1]
+    else:
+        with os.scandir(BASE_DIR) as entries:
+            folders = sorted(e.name for e in entries if e.is_dir())
+        _folders_cache = (mtime, folders)
+
+    return _conditional_page(render_template('index.html', folders=folders))
 
 @app.route('/create', methods=['GET', 'POST'])
 def create_folder():
     if request.method == 'POST':
         folder_name = request.form['folder_name']
-        folder_path = os.path.join(BASE_DIR, folder_name)
+        folder_path = safe_path(folder_name)
 
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
-            csv_path = os.path.join(folder_path, 'schedule.csv')
-            df = pd.DataFrame(columns=[
-                'Start Date', 'End Date', 'Start Time', 'Duration (minutes)',
-                'Frequency (MHz)', 'Mode', 'Power (W)', 'Pause (sec)'
-            ])
-            df.to_csv(csv_path, index=False, sep=';')
+            csv_path = folder_path / 'schedule.csv'
+            with open(csv_path, 'wb') as f:
+                f.write(SCHEDULE_HEADER)
             flash('Folder created successfully!', 'success')
         else:
             flash('Folder already exists!', 'error')
@@ -38,43 +126,64 @@ def create_folder():
 
 @app.route('/edit/<folder_name>', methods=['GET', 'POST'])
 def edit_schedule(folder_name):
-    base_dir = os.path.abspath(BASE_DIR)
-
-    # Securely join paths
-    csv_path = os.path.abspath(os.path.join(base_dir, folder_name, 'schedule.csv'))
-
-    # Check if the paths are within the base directory
-    if not csv_path.startswith(base_dir):
-        abort(403)  # Forbidden access
+    csv_path = safe_path(folder_name, 'schedule.csv')
 
     if request.method == 'POST':
         data = request.form.to_dict(flat=False)
-        df = pd.DataFrame(data)
-
-        df.to_csv(csv_path, index=False, sep=';')
+        rows = zip(*(data.get(column, []) for column in SCHEDULE_COLUMNS))
+
+        # Write a temporary file and rename it over the schedule so readers
+        # never see a partially written file
+        tmp_path = csv_path.with_name(f'.{csv_path.name}.{os.getpid()}.tmp')
+        with _schedule_lock(csv_path):
+            with open(tmp_path, 'w', newline='') as f:
+                writer = csv.writer(f, delimiter=';', lineterminator='\n')
+                writer.writerow(SCHEDULE_COLUMNS)
+                writer.writerows(rows)
+            os.replace(tmp_path, csv_path)
+            _schedule_cache.pop(csv_path, None)
         flash('Schedule updated successfully!', 'success')
         return redirect(url_for('index'))
 
-    df = pd.read_csv(csv_path, sep=';')
-    return render_template('edit_schedule.html', folder_name=folder_name, data=df.to_dict(orient='records'))
+    try:
+        st = os.stat(csv_path)
+    except FileNotFoundError:
+        abort(404)
+
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    cached = _schedule_cache.get(csv_path)
+    if cached and cached[0] == key:
+        data = cached[1]
+    else:
+        with open(csv_path, newline='') as f:
+            data = list(csv.DictReader(f, delimiter=';'))
+        _schedule_cache[csv_path] = (key, data)
+
+    return render_template('edit_schedule.html', folder_name=folder_name, data=data)
 
 # Route to Manage Audio Files
 @app.route('/manage_audio/<folder_name>', methods=['GET'])
 def manage_audio(folder_name):
-    base_dir = os.path.abspath(BASE_DIR)
+    safe_folder_path = safe_path(folder_name)
 
-    # Securely join paths
-    safe_folder_path = os.path.abspath(os.path.join(base_dir, folder_name))
+    try:
+        mtime = os.stat(safe_folder_path).st_mtime_ns
+    except FileNotFoundError:
+        abort(404)
 
-    # Check if the paths are within the base directory
-    if not safe_folder_path.startswith(base_dir):
-        abort(403)  # Forbidden access
-
-    audio_files = []
-    for f in ("*.wav", "*.mp3"):
-        audio_files.extend(sorted(glob(f, root_dir=safe_folder_path)))
+    cached = _audio_files_cache.get(safe_folder_path)
+    if cached and cached[0] == mtime:
+        audio_files = cached[1]
+    else:
+        with os.scandir(safe_folder_path) as entries:
+            names = [e.name for e in entries
+                     if os.path.splitext(e.name)[1].lower() in AUDIO_EXTENSIONS
+                     and not e.name.startswith('.') and e.is_file()]
+        # WAV files first, then MP3, in the order the transmitter plays them
+        audio_files = sorted(names, key=lambda name: (name.lower().endswith('.mp3'), name))
+        _audio_files_cache[safe_folder_path] = (mtime, audio_files)
 
-    return render_template('audio_files.html', folder_name=folder_name, audio_files=audio_files)
+    return _conditional_page(render_template('audio_files.html', folder_name=folder_name, audio_files=audio_files))
 
 # Route to Upload Audio File
 @app.route('/upload_audio/<folder_name>', methods=['POST'])
@@ -82,22 +191,14 @@ def upload_audio_file(folder_name):
     if 'audio_file' not in request.files:
         return "No file part", 400
 
-    base_dir = os.path.abspath(BASE_DIR)
-
-    # Securely join paths
-    safe_folder_path = os.path.abspath(os.path.join(base_dir, folder_name))
-
-
     file = request.files['audio_file']
     if file.filename == '':
         return "No selected file", 400
 
-    if file.filename.lower().endswith(('.wav', '.mp3')):
-        safe_file_path = os.path.abspath(os.path.join(safe_folder_path, file.filename))
-        if not safe_file_path.startswith(base_dir):
-            abort(403)
+    if os.path.splitext(file.filename)[1].lower() in AUDIO_EXTENSIONS:
+        safe_file_path = safe_path(folder_name, file.filename)
 
-        file.save(safe_file_path)
+        _save_upload(file, safe_file_path)
         return '', 200
 
     return "Invalid file", 400
@@ -105,40 +206,38 @@ def upload_audio_file(folder_name):
 # Route to Delete Audio File
 @app.route('/delete_audio/<folder_name>/<file_name>', methods=['POST'])
 def delete_audio_file(folder_name, file_name):
-    base_dir = os.path.abspath(BASE_DIR)
-
-    # Securely join paths
-    safe_folder_path = os.path.abspath(os.path.join(base_dir, folder_name))
-    safe_file_path = os.path.abspath(os.path.join(safe_folder_path, file_name))
+    safe_file_path = safe_path(folder_name, file_name)
 
-    # Check if the paths are within the base directory
-    if not safe_file_path.startswith(base_dir):
-        abort(403)  # Forbidden access
-
-    if os.path.exists(safe_file_path):
+    try:
         os.remove(safe_file_path)
+    except FileNotFoundError:
+        pass
 
     return redirect(url_for('manage_audio', folder_name=folder_name))
 
 # Route to stream audio files
 @app.route('/stream_audio/<folder_name>/<file_name>')
 def stream_audio(folder_name, file_name):
-    base_dir = os.path.abspath(BASE_DIR)
+    safe_file_path = safe_path(folder_name, file_name)
 
-    # Securely join paths
-    safe_folder_path = os.path.abspath(os.path.join(base_dir, folder_name))
-    safe_file_path = os.path.abspath(os.path.join(safe_folder_path, file_name))
-
-    # Check if the paths are within the base directory
-    if not safe_file_path.startswith(base_dir):
-        abort(403)  # Forbidden access
+    # Check if the file exists and is a file, with a single stat
+    try:
+        st = os.stat(safe_file_path)
+    except OSError:
+        abort(404)  # File not found
 
-    # Check if the file exists and is a file
-    if os.path.exists(safe_file_path) and os.path.isfile(safe_file_path):
-        return send_from_directory(directory=safe_folder_path, path=os.path.basename(safe_file_path), as_attachment=False)
-    else:
+    if not stat.S_ISREG(st.st_mode):
         abort(404)  # File not found
 
+    if ACCEL_REDIRECT_PREFIX:
+        response = Response(mimetype=mimetypes.guess_type(safe_file_path)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = ACCEL_REDIRECT_PREFIX + quote(safe_file_path.relative_to(BASE_PATH).as_posix())
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response
+
+    # The path is already checked, serve it directly with Range and ETag support
+    return send_file(safe_file_path, conditional=True, etag=True)
+
 
 if __name__ == '__main__':
     app.run("::", debug=True)
@@ -1,7 +1,6 @@
 import os
 import signal
 import sys
-from glob import glob
 import time
 from datetime import datetime, timedelta
 
@@ -9,6 +8,11 @@ from datetime import datetime, timedelta
 import yaml
 import csv
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 # Rig control
 import Hamlib
 
@@ -18,6 +22,17 @@ import pygame._sdl2.audio as sdl2_audio
 
 running = True
 
+# Audio file types transmitted from a set folder
+AUDIO_EXTENSIONS = frozenset({'.wav', '.mp3'})
+
+# Schedule mode names mapped to Hamlib modes
+MODES = {
+    "USB": Hamlib.RIG_MODE_PKTUSB,
+    "LSB": Hamlib.RIG_MODE_PKTLSB,
+    "FM": Hamlib.RIG_MODE_FM,
+    "AM": Hamlib.RIG_MODE_AM,
+}
+
 
 ### Audio playback functions
 def _get_audio_devices(capture_devices: bool = False):
@@ -40,7 +55,7 @@ def get_audio_output_device(device_name):
 
 def load_config(config_file):
     with open(config_file, 'r') as file:
-        return yaml.safe_load(file)
+        return yaml.load(file, Loader=SafeLoader)
 
 def log_message(message, level="info"):
     if level == "debug":
@@ -93,9 +108,12 @@ def transmit(rig : Hamlib.Rig, set_folder, frequency, mode, power, pause, signal
         log_message("Signal power threshold not met. Transmission aborted.", level="error")
         return
 
-    files = []
-    for f in ("*.wav", "*.mp3"):
-        files.extend(sorted(glob(f, root_dir=set_folder)))
+    with os.scandir(set_folder) as entries:
+        names = [e.name for e in entries
+                 if os.path.splitext(e.name)[1].lower() in AUDIO_EXTENSIONS
+                 and not e.name.startswith('.') and e.is_file()]
+    # WAV files first, then MP3, each in name order
+    files = sorted(names, key=lambda name: (name.lower().endswith('.mp3'), name))
 
     for file in files:
         log_message(f"Transmitting {file}...")
@@ -163,16 +181,10 @@ def handle_shutdown(signum, frame):
 
 
 def parse_mode(mode):
-    if mode == "USB":
-        return Hamlib.RIG_MODE_PKTUSB
-    elif mode == "LSB":
-        return Hamlib.RIG_MODE_PKTLSB
-    elif mode == "FM":
-        return Hamlib.RIG_MODE_FM
-    elif mode == "AM":
-        return Hamlib.RIG_MODE_AM
-    else:
-        raise ValueError(f"Invalid mode: {mode}")
+    try:
+        return MODES[mode]
+    except KeyError:
+        raise ValueError(f"Invalid mode: {mode}") from None
 
 
 def parse_schedule(file_path):
@@ -248,15 +260,15 @@ def check_overlaps(schedules):
 
 def load_and_check_schedules(transmit_sets_path):
     schedule_files = []
-    for set_folder in os.listdir(transmit_sets_path):
-        set_path = os.path.join(transmit_sets_path, set_folder)
-        if os.path.isdir(set_path):
-            schedule_file = os.path.join(set_path, 'schedule.csv')
-            if not os.path.exists(schedule_file):
-                log_message(f"Warning: Schedule file not found in set {set_folder}. Skipping.", level="warning")
-                continue
+    with os.scandir(transmit_sets_path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                schedule_file = os.path.join(entry.path, 'schedule.csv')
+                if not os.path.exists(schedule_file):
+                    log_message(f"Warning: Schedule file not found in set {entry.name}. Skipping.", level="warning")
+                    continue
 
-            schedule_files.append(schedule_file)
+                schedule_files.append(schedule_file)
 
     all_schedules = []
     for file_path in schedule_files:
@@ -294,6 +306,7 @@ def main():
         sys.exit(1)
 
     schedules = []
+    logged_schedules = None
     while running:
         now = datetime.now()
         try:
@@ -301,18 +314,17 @@ def main():
         except Exception as e:
             log_message(f"Error loading schedules: {e}", level="warning")
 
-        log_message("Current schedules:", "info")
-        print_schedules(schedules)
+        # Only log the schedule list when it differs from the last loop
+        if schedules != logged_schedules:
+            log_message("Current schedules:", "info")
+            print_schedules(schedules)
+            logged_schedules = schedules
 
         for row in schedules:
             set_folder = row['set_folder']
             start_datetime = row['start_datetime']
 
-            if now.date() != start_datetime.date():
-                log_message("This schedule is not active at the moment: " + str(row['start_datetime']))
-                continue
-
-            if now.time() >= start_datetime.time() and now.time() <= (datetime.combine(datetime.today(), start_datetime.time()) + timedelta(minutes=int(row['duration']))).time():
+            if start_datetime <= now <= row['end_datetime']:
                 log_message("Actual schedule:")
                 print_schedules([row])
                 transmit(